@@ -1,5 +1,7 @@
+import sys
 import typing
-from dataclasses import dataclass
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
 
 
 @dataclass(frozen=True)
@@ -10,20 +12,107 @@ class Request:
     send: typing.Callable[[object], typing.Awaitable[None]]
 
 
+@dataclass(slots=True)
+class _Slot:
+    request: Request
+    specialities: tuple[str, ...]
+    busy: bool = False
+    # Free deques currently holding this ID: a speciality, or None for free_all
+    queued: set[typing.Optional[str]] = field(default_factory=set)
+
+
+_Handler = typing.Callable[[Request], typing.Awaitable[None]]
+
+
 class RestaurantManager:
-    def __init__(self):
+    __slots__ = ("_slots", "special", "free_by_spec", "free_all", "_dispatch")
+
+    def __init__(self) -> None:
         """Instantiate the restaurant manager.
 
         This is called at the start of each day before any staff get on
         duty or any orders come in. You should do any setup necessary
-        to get the system working before the day starts here; we have
-        already defined a staff dictionary.
+        to get the system working before the day starts here; on-duty
+        staff are kept in ``_slots`` and exposed through ``staff``.
+        """
+        self._slots: dict[str, _Slot] = {}
+        self.special: defaultdict[str, set[str]] = defaultdict(set)
+        self.free_by_spec: defaultdict[str, deque[str]] = defaultdict(deque)
+        self.free_all: deque[str] = deque()
+        self._dispatch: dict[str, _Handler] = {
+            sys.intern("staff.onduty"): self._on_onduty,
+            sys.intern("staff.offduty"): self._on_offduty,
+            sys.intern("order"): self._on_order,
+        }
+
+    @property
+    def staff(self) -> dict[str, Request]:
+        """On-duty staff requests keyed by staff ID."""
+        return {staff_id: slot.request for staff_id, slot in self._slots.items()}
+
+    def _checkout(self, speciality: typing.Optional[str]) -> tuple[str, _Slot]:
+        """Take a free staff member, preferring one with the given speciality.
+
+        Staff are handed out round-robin. Each ID is queued at most once
+        per deque, but taking someone from one deque leaves them in the
+        others; those busy entries are dropped when they come up.
         """
-        self.staff = {}
-        self.special = {}
-        self.busy = set()
+        slots = self._slots
+        dq = self.free_by_spec.get(speciality) if speciality is not None else None
+        found: typing.Optional[tuple[str, _Slot]] = self._pop_free(dq, speciality, slots) if dq else None
+        if found is None:
+            found = self._pop_free(self.free_all, None, slots)
+        if found is None:
+            raise LookupError("No free staff available")
+        return found
 
-    async def __call__(self, request: Request):
+    @staticmethod
+    def _pop_free(
+            dq: deque[str], key: typing.Optional[str], slots: dict[str, _Slot]
+    ) -> typing.Optional[tuple[str, _Slot]]:
+        """Pop the first ID in the deque that is still free and mark it busy."""
+        while dq:
+            staff_id: str = dq.popleft()
+            slot: _Slot = slots[staff_id]
+            slot.queued.discard(key)
+            if not slot.busy:
+                slot.busy = True
+                return staff_id, slot
+        return None
+
+    def _checkin(self, staff_id: str, slot: _Slot) -> None:
+        """Return a staff member to the free pools after an order."""
+        slot.busy = False
+        if self._slots.get(staff_id) is slot:
+            self._enqueue(staff_id, slot)
+
+    def _enqueue(self, staff_id: str, slot: _Slot) -> None:
+        """Append the ID to every free deque of theirs that doesn't hold it yet."""
+        queued = slot.queued
+        if None not in queued:
+            self.free_all.append(staff_id)
+            queued.add(None)
+        free_by_spec = self.free_by_spec
+        for spe in slot.specialities:
+            if spe not in queued:
+                free_by_spec[spe].append(staff_id)
+                queued.add(spe)
+
+    def _remove(self, staff_id: str) -> None:
+        """Drop a staff member's slot and their entries in the free deques."""
+        slot = self._slots.pop(staff_id)
+        free_by_spec = self.free_by_spec
+        for key in slot.queued:
+            (self.free_all if key is None else free_by_spec[key]).remove(staff_id)
+        special = self.special
+        for spe in slot.specialities:
+            members = special[spe]
+            members.discard(staff_id)
+            if not members:
+                del special[spe]
+                del free_by_spec[spe]
+
+    async def __call__(self, request: Request) -> None:
         """Handle a request received.
 
         This is called for each request received by your application.
@@ -33,43 +122,40 @@ class RestaurantManager:
             Request object containing information about the sent
             request to your application.
         """
+        handler: typing.Optional[_Handler] = self._dispatch.get(request.scope["type"])
+        if handler is not None:
+            await handler(request)
+
+    async def _on_onduty(self, request: Request) -> None:
+        """Register a staff member and make them available for orders."""
         _scope = request.scope
-        match _scope["type"]:
-            case "staff.onduty":
-                self.staff[_scope["id"]] = request
-                for spe in _scope["speciality"]:
-                    _special = self.special.get(spe, set())
-                    _special.add(_scope["id"])
-                    self.special[spe] = _special
-                    # print(spe, "$$$", self.special[spe])
-
-            case "staff.offduty":
-                for spe, sta in self.special.items():
-                    if _scope["id"] in sta:
-                        sta.remove(_scope["id"])
-                self.staff.pop(_scope["id"])
-
-            case "order":
-                found = None
-                if _scope["speciality"] in self.special:
-                    for sta in self.special[_scope["speciality"]]:
-                        # print("Found speciality")
-                        if sta not in self.busy:
-                            # print("Using speciality")
-                            found = self.staff[sta]
-                            break
-
-                if not found:
-                    for sta in self.staff.keys():
-                        if sta not in self.busy:
-                            found = self.staff[sta]
-                            break
-
-                self.busy.add(sta)
-                full_order = await request.receive()
-                await found.send(full_order)
-
-                result = await found.receive()
-                await request.send(result)
-
-                self.busy.remove(sta)
+        staff_id: str = _scope["id"]
+        specs: tuple[str, ...] = tuple(dict.fromkeys(map(sys.intern, _scope["speciality"])))
+        slots = self._slots
+        if staff_id in slots:
+            self._remove(staff_id)
+        slot = slots[staff_id] = _Slot(request, specs)
+        special = self.special
+        for spe in specs:
+            special[spe].add(staff_id)
+        self._enqueue(staff_id, slot)
+
+    async def _on_offduty(self, request: Request) -> None:
+        """Remove a staff member from every pool they belong to."""
+        self._remove(request.scope["id"])
+
+    async def _on_order(self, request: Request) -> None:
+        """Hand the order to a free staff member and relay the result."""
+        speciality: typing.Optional[str] = request.scope.get("speciality")
+        full_order = await request.receive()
+
+        found_id, slot = self._checkout(speciality)
+        try:
+            await slot.request.send(full_order)
+            result = await slot.request.receive()
+        finally:
+            # The staff is done once the result is in; free them before the
+            # customer send so queued orders are not held up by it.
+            self._checkin(found_id, slot)
+
+        await request.send(result)
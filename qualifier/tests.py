@@ -1,5 +1,8 @@
+import asyncio
+import collections
 import random
 import unittest
+import functools
 import itertools
 from types import MappingProxyType
 from typing import Any, Awaitable, Callable
@@ -30,6 +33,12 @@ def create_request(
     return Request(MappingProxyType(scope), receive, send)
 
 
+@functools.cache
+def create_order(speciality: str) -> Request:
+    # Orders with the default no-op receive/send are interchangeable, so share them
+    return create_request({"type": "order", "speciality": speciality})
+
+
 def wrap_receive_mock(id_: str, mock: AsyncMock) -> Callable[[], Awaitable[object]]:
     async def receive() -> object:
         return await mock(id_)
@@ -219,14 +228,14 @@ class DeliveringTests(QualifierTestCase):
         random.shuffle(staff_ids)
         random.shuffle(specialities)
 
-        staff_receive, staff_send = AsyncMock(), AsyncMock()
+        staff_send = AsyncMock()
         staff = {
             id_: create_request(
                 {"type": "staff.onduty", "id": id_, "speciality": [speciality]},
 
-                # We wrap the mocks so that they pass the ID of the staff, that way
-                # we can ensure that the order was both sent and received to the same staff.
-                wrap_receive_mock(id_, staff_receive), wrap_send_mock(id_, staff_send)
+                # Only the send mock is wrapped, so that it passes the ID of the staff that
+                # got the order; receive is a plain stub since its calls are never asserted.
+                _receive, wrap_send_mock(id_, staff_send)
             )
             for id_, speciality in zip(staff_ids, specialities)
         }
@@ -234,7 +243,7 @@ class DeliveringTests(QualifierTestCase):
         for request in staff.values():
             await self.manager(request)
 
-        orders = [create_request({"type": "order", "speciality": speciality}) for speciality in specialities * 10]
+        orders = [create_order(speciality) for speciality in specialities * 10]
 
         for order in orders:
             await self.manager(order)
@@ -258,14 +267,14 @@ class DeliveringTests(QualifierTestCase):
         random.shuffle(staff_ids)
         random.shuffle(specialities)
 
-        staff_receive, staff_send = AsyncMock(), AsyncMock()
+        staff_send = AsyncMock()
         staff = {
             id_: create_request(
                 {"type": "staff.onduty", "id": id_, "speciality": [speciality]},
 
-                # We wrap the mocks so that they pass the ID of the staff, that way
-                # we can ensure that the order was both sent and received to the same staff.
-                wrap_receive_mock(id_, staff_receive), wrap_send_mock(id_, staff_send)
+                # Only the send mock is wrapped, so that it passes the ID of the staff that
+                # got the order; receive is a plain stub since its calls are never asserted.
+                _receive, wrap_send_mock(id_, staff_send)
             )
             for id_, speciality in zip(staff_ids, itertools.cycle(specialities))
         }
@@ -274,7 +283,7 @@ class DeliveringTests(QualifierTestCase):
             await self.manager(request)
 
         orders = [
-            create_request({"type": "order", "speciality": speciality})
+            create_order(speciality)
             for speciality in itertools.chain(*itertools.repeat(specialities, 5))
         ]
 
@@ -296,24 +305,24 @@ class DeliveringTests(QualifierTestCase):
     async def test_multiple_specialities(self) -> None:
         id_one, id_two = random.sample(STAFF_IDS, 2)
 
-        staff_receive, staff_send = AsyncMock(), AsyncMock()
+        staff_send = AsyncMock()
 
         staff_one = create_request(
             {"type": "staff.onduty", "id": id_one, "speciality": [SPECIALITIES[0]]},
-            wrap_receive_mock(id_one, staff_receive),
+            _receive,
             wrap_send_mock(id_one, staff_send)
         )
         await self.manager(staff_one)
 
         staff_two = create_request(
             {"type": "staff.onduty", "id": id_two, "speciality": SPECIALITIES[1:]},
-            wrap_receive_mock(id_two, staff_receive),
+            _receive,
             wrap_send_mock(id_two, staff_send)
         )
         await self.manager(staff_two)
 
         orders = [
-            create_request({"type": "order", "speciality": speciality})
+            create_order(speciality)
             for speciality in itertools.chain(*itertools.repeat(SPECIALITIES, 5))
         ]
 
@@ -328,3 +337,117 @@ class DeliveringTests(QualifierTestCase):
                 self.assertEqual(staff_id, staff_two.scope["id"], msg="Order speciality not match with speciality of staff")
 
             staff_send.reset_mock()
+
+    async def test_concurrent_orders_use_free_staff(self) -> None:
+        # While one staff is busy with an order, the next order must go to another staff.
+        id_one, id_two = random.sample(STAFF_IDS, 2)
+        release = asyncio.Event()
+
+        staff_send = AsyncMock()
+
+        async def staff_receive(id_: str) -> object:
+            await release.wait()
+            return id_
+
+        for id_ in (id_one, id_two):
+            await self.manager(create_request(
+                {"type": "staff.onduty", "id": id_, "speciality": [SPECIALITIES[0]]},
+                functools.partial(staff_receive, id_), wrap_send_mock(id_, staff_send)
+            ))
+
+        orders = [
+            create_request({"type": "order", "speciality": SPECIALITIES[0]}, AsyncMock(), AsyncMock())
+            for _ in range(2)
+        ]
+
+        tasks = [asyncio.create_task(self.manager(order)) for order in orders]
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(*tasks)
+
+        served = {order.send.call_args.args[0] for order in orders}
+        self.assertEqual(served, {id_one, id_two}, msg="Concurrent orders not spread across free staff")
+
+    async def test_even_distribution_with_fallback(self) -> None:
+        # Mixing speciality orders with ones nobody specialises in must still spread work evenly
+        staff_send = AsyncMock()
+        for id_ in STAFF_IDS[:3]:
+            await self.manager(create_request(
+                {"type": "staff.onduty", "id": id_, "speciality": [SPECIALITIES[0]]},
+                _receive, wrap_send_mock(id_, staff_send)
+            ))
+
+        for speciality in itertools.islice(itertools.cycle(SPECIALITIES[:2]), 30):
+            await self.manager(create_order(speciality))
+
+        served = collections.Counter(call.args[0] for call in staff_send.call_args_list)
+        self.assertEqual(served, dict.fromkeys(STAFF_IDS[:3], 10), msg="Orders not distributed evenly")
+
+
+class ShiftTests(QualifierTestCase):
+
+    async def test_repeated_shifts(self) -> None:
+        # Staff going on and off duty many times must not leave anything behind
+        id_ = STAFF_IDS[0]
+        for _ in range(50):
+            await self.manager(create_request({"type": "staff.onduty", "id": id_, "speciality": [SPECIALITIES[0]]}))
+            await self.manager(create_request({"type": "staff.offduty", "id": id_}))
+
+        self.verify_staff_dict()
+        self.assertEqual(self.manager.staff, {}, msg="Staff not removed after going off-duty")
+        self.assertEqual(len(self.manager.free_all), 0, msg="Free staff queue not emptied after going off-duty")
+        self.assertNotIn(SPECIALITIES[0], self.manager.special, msg="Empty speciality bucket left behind")
+        self.assertNotIn(SPECIALITIES[0], self.manager.free_by_spec, msg="Empty speciality queue left behind")
+
+        staff = create_request(
+            {"type": "staff.onduty", "id": id_, "speciality": [SPECIALITIES[0]]}, AsyncMock(), AsyncMock()
+        )
+        await self.manager(staff)
+
+        self.assertEqual(len(self.manager.free_all), 1, msg="Free staff queue grew across shifts")
+        self.assertEqual(len(self.manager.free_by_spec[SPECIALITIES[0]]), 1, msg="Speciality queue grew across shifts")
+
+        order = create_request({"type": "order", "speciality": SPECIALITIES[0]}, AsyncMock(), AsyncMock())
+        await self.manager(order)
+
+        staff.send.assert_awaited_once()
+        staff.receive.assert_awaited_once()
+
+    async def test_staff_free_during_customer_send(self) -> None:
+        # A slow customer must not keep the staff busy once the result is ready
+        id_ = STAFF_IDS[0]
+        release = asyncio.Event()
+
+        staff = create_request(
+            {"type": "staff.onduty", "id": id_, "speciality": [SPECIALITIES[0]]}, AsyncMock(), AsyncMock()
+        )
+        await self.manager(staff)
+
+        async def slow_send(_: object) -> None:
+            await release.wait()
+
+        slow = create_request({"type": "order", "speciality": SPECIALITIES[0]}, AsyncMock(), slow_send)
+        slow_task = asyncio.create_task(self.manager(slow))
+        await asyncio.sleep(0)
+
+        order = create_request({"type": "order", "speciality": SPECIALITIES[0]}, AsyncMock(), AsyncMock())
+        await self.manager(order)
+
+        self.assertFalse(slow_task.done())
+        order.send.assert_awaited_once()
+        self.assertEqual(staff.send.await_count, 2, msg="Staff not reused while customer send was pending")
+
+        release.set()
+        await slow_task
+
+    async def test_repeated_speciality(self) -> None:
+        # A speciality listed twice must not break going off-duty
+        id_ = STAFF_IDS[0]
+        await self.manager(create_request({"type": "staff.onduty", "id": id_, "speciality": [SPECIALITIES[0]] * 2}))
+
+        self.assertIn(id_, self.manager.staff, msg="Staff not registered with the correct ID")
+
+        await self.manager(create_request({"type": "staff.offduty", "id": id_}))
+
+        self.verify_staff_dict()
+        self.assertEqual(self.manager.staff, {}, msg="Staff not removed after going off-duty")